@@ -4,31 +4,43 @@
 """
 
 # 引入标准库与第三方库
+# - asyncio: 回放缓存回答时让出事件循环
+# - io: 内存文本缓冲区，收集流式输出的完整回答
 # - os: 读取系统环境变量
+# - functools: 缓存系统提示词等纯函数结果
 # - logging: 统一日志输出，方便调试
-# - typing.Optional, typing.Any: 类型注解
+# - re: 正则表达式，用于关键词检索与回答格式化
+# - unicodedata: 规范化问题文本（全角/半角统一）
+# - typing.TYPE_CHECKING, typing.Optional, typing.Any, typing.AsyncGenerator: 类型注解
 # - fastapi: 创建 Web 服务
 # - fastapi.middleware.cors: 处理跨域请求
-# - fastapi.responses: 流式响应支持
+# - fastapi.responses, starlette.types: 流式响应支持
 # - pydantic: 定义请求体数据模型
-# - zai: 官方智谱 AI Python SDK，封装模型调用
+# - httpx: 异步 HTTP 客户端，直接调用智谱 AI 流式接口
+# - orjson: 高性能 JSON 序列化，用于编码 SSE 数据帧与解析上游数据
+# - cachetools: 带过期时间的内存缓存，缓存重复问题的回答
 # - dotenv: 从 .env 文件加载环境变量
+import asyncio
+import io
 import os
-import json
+import functools
 import logging
+import re
 import time
-from typing import Optional, Any, Generator
+import unicodedata
+from typing import TYPE_CHECKING, Optional, Any, AsyncGenerator
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
+from starlette.types import Send
 from pydantic import BaseModel
-from dotenv import load_dotenv
-from zai import ZhipuAiClient
-
+import orjson
+from cachetools import TTLCache
 
-# 从 .env 文件加载环境变量，确保 ZHIPU_API_KEY 在运行前已正确配置。
-load_dotenv()
+# httpx 与 dotenv 较重，延迟到应用启动时再导入，加快 worker 冷启动
+if TYPE_CHECKING:
+    import httpx
 
 
 # 配置日志格式与等级，使控制台可以输出详细的请求/响应信息。
@@ -57,6 +69,39 @@ app.add_middleware(
 )
 
 
+@app.on_event("startup")
+async def _startup() -> None:
+    """应用启动时执行的初始化操作（不放在模块导入阶段，避免拖慢 worker 启动）。"""
+    from dotenv import load_dotenv
+
+    # 从 .env 文件加载环境变量，确保 ZHIPU_API_KEY 在处理请求前已正确配置。
+    load_dotenv()
+
+    # 创建长期复用的异步 HTTP 客户端：连接池 + HTTP/2 多路复用，
+    # 避免每个请求都重新进行 TCP/TLS 握手，降低首字节时间。
+    app.state.http = None
+    try:
+        import httpx
+
+        app.state.http = httpx.AsyncClient(
+            base_url=ZHIPU_BASE_URL,
+            http2=True,
+            timeout=httpx.Timeout(60, connect=5),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        )
+    except Exception as exc:
+        logger.error("❌ 初始化智谱 AI 客户端失败：%s", exc)
+
+
+@app.on_event("shutdown")
+async def _shutdown() -> None:
+    """应用关闭时释放连接池。"""
+    client = getattr(app.state, "http", None)
+    app.state.http = None
+    if client is not None:
+        await client.aclose()
+
+
 # 定义请求体数据模型
 class PetProfile(BaseModel):
     name: Optional[str] = None
@@ -83,6 +128,36 @@ def is_safety_question(question: str) -> bool:
     safety_keywords = ["能吃", "不能吃", "可以吃", "不可以吃", "安全", "有毒", "危险", "有害", "会不会", "是否", "能不能", "能不能给"]
     return any(keyword in question for keyword in safety_keywords)
 
+# 系统提示词片段（优化：简化提示词，减少token数，加快响应）
+_BASE_SYSTEM_PROMPT = "你是宠物营养专家。简要回答。\n重要：只输出最终答案，不要输出思考过程、推理过程或任何标签（如<thinking>、<reasoning>等）。"
+# "能不能吃"类问题：使用标准格式
+_SAFETY_FORMAT_PROMPT = "\n格式：\n【风险等级】：[等级]\n【风险点】：[风险]\n【喂养建议】：[建议]"
+# 其他问题：自然回答，无需固定格式
+_NATURAL_FORMAT_PROMPT = "\n回答方式：自然、专业、简洁，直接回答问题即可，无需使用固定格式。"
+
+# 无过敏原时的完整提示词是固定的，预先拼接好直接返回
+_SAFETY_SYSTEM_PROMPT = _BASE_SYSTEM_PROMPT + _SAFETY_FORMAT_PROMPT
+_NATURAL_SYSTEM_PROMPT = _BASE_SYSTEM_PROMPT + _NATURAL_FORMAT_PROMPT
+
+@functools.lru_cache(maxsize=256)
+def _build_system_prompt_cached(is_safety: bool, pet_name: Optional[str], allergies: tuple[str, ...]) -> str:
+    """根据问题类型与过敏原信息拼接系统提示词，结果按参数缓存。
+    
+    每个请求都会解析出新的 PetProfile 对象，因此缓存放在模块级别，按可哈希的参数跨请求共享。
+    
+    Args:
+        is_safety: 是否为"能不能吃"类问题
+        pet_name: 宠物名称
+        allergies: 过敏原元组（需可哈希以作为缓存键）
+        
+    Returns:
+        系统提示词字符串
+    """
+    allergies_str = "、".join(allergies)
+    allergy_prompt = f"\n过敏原：{pet_name or '该宠物'}对{allergies_str}过敏。如食物含过敏原，标记【高危预警】，禁止喂食。"
+    format_prompt = _SAFETY_FORMAT_PROMPT if is_safety else _NATURAL_FORMAT_PROMPT
+    return _BASE_SYSTEM_PROMPT + allergy_prompt + format_prompt
+
 def build_system_prompt(question: str, pet_profile: Optional[PetProfile] = None) -> str:
     """构建系统提示词，根据问题类型和宠物档案信息动态生成。
     
@@ -96,27 +171,15 @@ def build_system_prompt(question: str, pet_profile: Optional[PetProfile] = None)
     # 判断问题类型：是否为"能不能吃"类问题
     is_safety = is_safety_question(question)
     
-    # 优化：简化提示词，减少token数，加快响应
-    base_prompt = "你是宠物营养专家。简要回答。\n重要：只输出最终答案，不要输出思考过程、推理过程或任何标签（如<thinking>、<reasoning>等）。"
-    
-    # 如果有宠物档案，添加过敏原检查指令
-    if pet_profile and pet_profile.allergies and len(pet_profile.allergies) > 0:
-        pet_name = pet_profile.name or "该宠物"
-        allergies_str = "、".join(pet_profile.allergies)
-        base_prompt += f"\n过敏原：{pet_name}对{allergies_str}过敏。如食物含过敏原，标记【高危预警】，禁止喂食。"
-    
-    # 根据问题类型选择回答格式
-    if is_safety:
-        # "能不能吃"类问题：使用标准格式
-        base_prompt += "\n格式：\n【风险等级】：[等级]\n【风险点】：[风险]\n【喂养建议】：[建议]"
-    else:
-        # 其他问题：自然回答，无需固定格式
-        base_prompt += "\n回答方式：自然、专业、简洁，直接回答问题即可，无需使用固定格式。"
+    # 没有过敏原信息（最常见情况）：直接返回预先拼接好的常量
+    if not (pet_profile and pet_profile.allergies):
+        return _SAFETY_SYSTEM_PROMPT if is_safety else _NATURAL_SYSTEM_PROMPT
     
-    return base_prompt
-
+    # 有过敏原信息：同一档案在会话中反复使用，提示词可直接命中缓存
+    return _build_system_prompt_cached(is_safety, pet_profile.name, tuple(pet_profile.allergies))
 
 ZHIPU_MODEL_NAME: str = "GLM-4-Flash-250414"
+ZHIPU_BASE_URL: str = "https://open.bigmodel.cn/api/paas/v4"
 
 # app.py - 在 ZHIPU_MODEL_NAME 常量下方加入
 # ---------------------------------------------------------------------------
@@ -136,25 +199,48 @@ PET_KNOWLEDGE = {
 }
 
 
-def get_rag_info(question: str) -> str:
-    """RAG 知识检索：通过关键词匹配，从本地知识库中检索安全信息。"""
-    retrieved_facts = []
-    lower_question = question.lower()
+# 关键词正则：将所有知识库关键词合并为一个预编译的多选分支，由 re 在 C 层完成搜索。
+# 注意这不是自动机：每个候选位置都会逐个尝试各分支，耗时随关键词数量线性增长，
+# 适合当前规模的小型知识库。按长度倒序排列，同一位置优先匹配最长关键词。
+_KEYWORD_RE = re.compile("|".join(
+    re.escape(keyword) for keyword in sorted(PET_KNOWLEDGE, key=len, reverse=True)
+))
+
 
-    # 优化：使用更高效的匹配方式，只匹配第一个匹配项（大多数情况下只需要一个）
-    for item, fact in PET_KNOWLEDGE.items():
-        if item in lower_question:
-            retrieved_facts.append(f"【{item}】{fact}")
-            break  # 找到第一个匹配就返回，减少处理时间
+def normalize_question(question: str) -> str:
+    """规范化问题文本（全角/半角统一、大小写折叠、去除首尾空白），用于关键词检索与缓存键。"""
+    return unicodedata.normalize('NFKC', question).casefold().strip()
 
-    if retrieved_facts:
-       # 进一步简化格式，减少token数
-       return "\n参考：" + retrieved_facts[0]
-    else:
+def get_rag_info(normalized_question: str) -> str:
+    """RAG 知识检索：通过关键词匹配，从本地知识库中检索安全信息。
+    
+    Args:
+        normalized_question: 经 normalize_question 规范化后的用户问题
+    """
+    # 只取问题中第一个出现的关键词（大多数情况下只需要一个）
+    match = _KEYWORD_RE.search(normalized_question)
+    if not match:
         return ""
+
+    keyword = match.group()
+    # 进一步简化格式，减少token数
+    return f"\n参考：【{keyword}】{PET_KNOWLEDGE[keyword]}"
 # ---------------------------------------------------------------------------
 
-import re
+# 预编译正则表达式：流式输出与格式化都会频繁调用，避免每次调用时重复查找正则缓存。
+# 思考过程标签（成对标签，如<thinking>...</thinking>）
+_THINK_PAIR_RE = re.compile(r'<[^>]*(?:thinking|reasoning|redacted)[^>]*>.*?</[^>]*(?:thinking|reasoning|redacted)[^>]*>', re.DOTALL | re.IGNORECASE)
+# 思考过程自闭合标签（如<thinking/>）
+_THINK_SELF_RE = re.compile(r'<[^>]*(?:thinking|reasoning|redacted)[^>]*/?>', re.IGNORECASE)
+# 标签被移除后残留的思考过程/推理过程文本
+_THINK_PROCESS_RE = re.compile(r'思考过程[：:].*?(?=【|$)', re.DOTALL | re.IGNORECASE)
+_REASON_PROCESS_RE = re.compile(r'推理过程[：:].*?(?=【|$)', re.DOTALL | re.IGNORECASE)
+# 章节内的换行及其两侧空白（用于去掉空行和行首尾空白）
+_LINE_BREAKS_RE = re.compile(r'\s*\n\s*')
+
+# "能不能吃"类回答的章节标题，按出现顺序排列
+_SECTION_MARKERS = ('【风险等级】', '【风险点】', '【喂养建议】')
+_MAX_SECTION_MARKER_LEN = max(len(marker) for marker in _SECTION_MARKERS)
 
 def filter_thinking_content(content: str) -> str:
     """过滤思考过程内容，移除思考过程相关的标签和文本。
@@ -165,17 +251,28 @@ def filter_thinking_content(content: str) -> str:
     Returns:
         过滤后的内容
     """
-    if not content:
+    # 快速路径：绝大多数流式片段不含任何标签，无需执行正则替换
+    if not content or '<' not in content:
         return content
-    
+
     # 移除思考过程标签（成对标签，如<thinking>...</thinking>）
-    content = re.sub(r'<[^>]*(?:thinking|reasoning|redacted)[^>]*>.*?</[^>]*(?:thinking|reasoning|redacted)[^>]*>', '', content, flags=re.DOTALL | re.IGNORECASE)
+    content = _THINK_PAIR_RE.sub('', content)
     # 移除自闭合标签（如<thinking/>）
-    content = re.sub(r'<[^>]*(?:thinking|reasoning|redacted)[^>]*/?>', '', content, flags=re.IGNORECASE)
+    content = _THINK_SELF_RE.sub('', content)
     
     return content
 
-def format_ai_response(text: str, is_safety_question: bool = True) -> str:
+def _format_section(header: Optional[str], body: str) -> str:
+    """格式化单个章节：统一标题后的中文冒号，并去掉章节内的空行和行首尾空白。"""
+    body = body.strip()
+    if header is None:
+        return _LINE_BREAKS_RE.sub('\n', body)
+    # 标题后最多一个冒号（中英文均可），统一改为中文冒号
+    if body[:1] in (':', '：'):
+        body = body[1:].lstrip()
+    return header + '：' + _LINE_BREAKS_RE.sub('\n', body)
+
+def format_ai_response(text: str, is_safety_question: bool = True) -> tuple[str, tuple[bool, ...]]:
     """格式化AI回答，根据问题类型决定是否格式化。
     
     Args:
@@ -183,112 +280,160 @@ def format_ai_response(text: str, is_safety_question: bool = True) -> str:
         is_safety_question: 是否为"能不能吃"类问题，只有这类问题才需要格式化
         
     Returns:
-        格式化后的文本（如果是"能不能吃"类问题）或原始文本（其他问题）
+        (格式化后的文本（如果是"能不能吃"类问题）或原始文本（其他问题）,
+         各章节标题是否出现，顺序与 _SECTION_MARKERS 一致)
     """
+    seen = [False] * len(_SECTION_MARKERS)
     if not text:
-        return text
+        return text, tuple(seen)
     
     # 如果不是"能不能吃"类问题，直接返回原始文本，不进行格式化
     if not is_safety_question:
-        return text
-    
-    # 移除文本首尾空白
-    text = text.strip()
+        return text, tuple(seen)
     
     # 过滤思考过程：移除所有思考过程相关的标签和内容
     # 匹配各种可能的思考过程标签，包括<thinking>、<reasoning>、<think>等
-    text = re.sub(r'<[^>]*(?:thinking|reasoning|redacted)[^>]*>.*?</[^>]*(?:thinking|reasoning|redacted)[^>]*>', '', text, flags=re.DOTALL | re.IGNORECASE)
-    # 匹配自闭合标签
-    text = re.sub(r'<[^>]*(?:thinking|reasoning|redacted)[^>]*/?>', '', text, flags=re.IGNORECASE)
+    if '<' in text:
+        text = _THINK_PAIR_RE.sub('', text)
+        text = _THINK_SELF_RE.sub('', text)
     # 移除可能残留的思考过程内容（如果标签被移除但内容还在）
-    text = re.sub(r'思考过程[：:].*?(?=【|$)', '', text, flags=re.DOTALL | re.IGNORECASE)
-    text = re.sub(r'推理过程[：:].*?(?=【|$)', '', text, flags=re.DOTALL | re.IGNORECASE)
-    
-    # 第一步：统一冒号格式（英文冒号改为中文冒号）
-    text = re.sub(r'【风险等级】:\s*', '【风险等级】：', text)
-    text = re.sub(r'【风险点】:\s*', '【风险点】：', text)
-    text = re.sub(r'【喂养建议】:\s*', '【喂养建议】：', text)
-    
-    # 第二步：最关键 - 强制在标题之间插入换行（更全面的匹配）
-    # 使用更宽泛的模式，匹配任意字符直到下一个标题
-    
-    # 处理【风险等级】和【风险点】之间的换行
-    # 匹配：【风险等级】后面任意内容直到【风险点】
-    text = re.sub(r'【风险等级】[:：]?([^【]*?)【风险点】', r'【风险等级】：\1\n\n【风险点】', text, flags=re.DOTALL)
-    
-    # 处理【风险点】和【喂养建议】之间的换行
-    text = re.sub(r'【风险点】[:：]?([^【]*?)【喂养建议】', r'【风险点】：\1\n\n【喂养建议】', text, flags=re.DOTALL)
+    if '思考过程' in text:
+        text = _THINK_PROCESS_RE.sub('', text)
+    if '推理过程' in text:
+        text = _REASON_PROCESS_RE.sub('', text)
     
-    # 第四步：统一标题后的冒号格式（确保都有中文冒号）
-    text = re.sub(r'【风险等级】\s*[:：]\s*', '【风险等级】：', text)
-    text = re.sub(r'【风险点】\s*[:：]\s*', '【风险点】：', text)
-    text = re.sub(r'【喂养建议】\s*[:：]\s*', '【喂养建议】：', text)
+    # 从左到右单次扫描：以章节标题切分文本，每个章节（标题+内容）之间用空行分隔
+    output = io.StringIO()
+    separator = ''
+    header = None  # 当前章节标题，None 表示尚未遇到第一个标题
+    start = 0
+    pos = text.find('【')
+    while pos != -1:
+        order = next((i for i, marker in enumerate(_SECTION_MARKERS) if text.startswith(marker, pos)), None)
+        if order is not None:
+            # 扫描时顺带记录出现过的章节，调用方无需再次搜索全文
+            seen[order] = True
+            next_header = _SECTION_MARKERS[order]
+            section = _format_section(header, text[start:pos])
+            # 第一个标题之前的内容（理论上不应该出现）直接保留，只换行不加空行
+            if section or header is not None:
+                output.write(separator + section)
+                separator = '\n' if header is None else '\n\n'
+            header = next_header
+            start = pos + len(next_header)
+        pos = text.find('【', pos + 1)
+
+    output.write(separator + _format_section(header, text[start:]))
+    return output.getvalue(), tuple(seen)
+
+
+# 流式分段：流式输出时在后续章节标题前补齐空行
+def _count_trailing_newlines(text: str, previous: int) -> int:
+    """计算输出流末尾连续换行的数量（text 全为换行时需要累加之前的数量）。"""
+    stripped = text.rstrip('\n')
+    newlines = len(text) - len(stripped)
+    return previous + newlines if not stripped else newlines
+
+def insert_section_breaks(text: str, section: int, trailing_newlines: int) -> tuple[str, int, int]:
+    """在流式片段中检测章节标题，并在除第一个出现的章节外的每个章节标题前补齐空行。
     
-    # 第五步：重新组织文本，确保每个部分（标题+内容）之间有空行
-    lines = text.split('\n')
-    formatted_lines = []
-    current_section = []  # 当前正在处理的章节
-    section_title = None
-    
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-            
-        # 检查是否是新的标题行
-        is_header = False
-        header_type = None
-        if '【风险等级】' in line:
-            is_header = True
-            header_type = '风险等级'
-        elif '【风险点】' in line:
-            is_header = True
-            header_type = '风险点'
-        elif '【喂养建议】' in line:
-            is_header = True
-            header_type = '喂养建议'
+    Args:
+        text: 本次要发送的内容片段（调用方需保证标题不会被截断在片段末尾）
+        section: 当前所处章节在 _SECTION_MARKERS 中的下标，-1 表示尚未进入任何章节
+        trailing_newlines: 已发送内容末尾的连续换行数量
         
-        if is_header:
-            # 如果之前有章节，先保存它（在章节后添加空行）
-            if current_section:
-                formatted_lines.extend(current_section)
-                formatted_lines.append('')  # 章节之间添加空行
-            
-            # 开始新章节
-            current_section = []
-            section_title = header_type
-            # 确保标题格式正确
-            line = re.sub(r'【风险等级】\s*[:：]?\s*', '【风险等级】：', line)
-            line = re.sub(r'【风险点】\s*[:：]?\s*', '【风险点】：', line)
-            line = re.sub(r'【喂养建议】\s*[:：]?\s*', '【喂养建议】：', line)
-            current_section.append(line)
-        else:
-            # 当前行的内容属于当前章节
-            if current_section:
-                current_section.append(line)
-            else:
-                # 如果没有当前章节，直接添加（理论上不应该发生）
-                formatted_lines.append(line)
-    
-    # 添加最后一个章节
-    if current_section:
-        formatted_lines.extend(current_section)
-    
-    text = '\n'.join(formatted_lines)
-    
-    # 第六步：清理多余的空行（超过2个连续换行变为2个）
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    
-    # 第七步：确保文本开头和结尾格式正确（但保留各章节之间的空行）
-    # 只移除开头和结尾的空行，保留中间的空行
-    text = text.strip()
-    
-    return text
+    Returns:
+        (补齐空行后的片段, 新的章节下标, 新的末尾换行数量)
+    """
+    pieces = []
+    start = 0
+    pos = text.find('【')
+    while pos != -1:
+        for order in range(section + 1, len(_SECTION_MARKERS)):
+            if text.startswith(_SECTION_MARKERS[order], pos):
+                # 只有之前已经出现过章节（本片段或之前的片段）时才需要空行；
+                # 回答以第一个出现的标题开头时不补空行，与 format_ai_response 保持一致
+                if section >= 0:
+                    head = text[start:pos]
+                    pieces.append(head)
+                    trailing_newlines = _count_trailing_newlines(head, trailing_newlines)
+                    pieces.append('\n' * max(0, 2 - trailing_newlines))
+                    start = pos
+                section = order
+                break
+        pos = text.find('【', pos + 1)
+
+    tail = text[start:]
+    pieces.append(tail)
+    return ''.join(pieces), section, _count_trailing_newlines(tail, trailing_newlines)
+
+
+def _sse(payload: dict[str, Any]) -> bytes:
+    """将数据编码为 SSE 数据帧。orjson 在 C 层直接序列化为 UTF-8 字节，StreamingResponse 无需再次编码。"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def _content_frame(content: str) -> bytes:
+    """将内容片段编码为 {"content": ...} 的 SSE 数据帧（流式输出热路径）。"""
+    return _sse({"content": content})
+
+
+# 固定内容的 SSE 数据帧：内容从不变化，模块加载时编码一次，避免每次请求重复序列化
+_SSE_THINKING = _sse({"status": "thinking"})
+_SSE_DONE = _sse({"done": True})
+_SSE_ERR_NO_KEY = _sse({"error": "服务器未配置 AI 服务，请联系管理员。"})
+_SSE_ERR_INIT = _sse({"error": "AI 客户端初始化失败，请检查配置。"})
+_SSE_ERR_UPSTREAM = _sse({"error": "AI 服务暂时不可用，请稍后再试。"})
+
+class SSEResponse(StreamingResponse):
+    """SSE 流式响应：发送响应头后立即写出"思考中"帧，再开始迭代生成器。
+
+    "思考中"帧不再经过生成器调度，请求到达后即可写到连接上，缩短首字节时间。
+    """
+
+    async def stream_response(self, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.body", "body": _SSE_THINKING, "more_body": True})
+        async for chunk in self.body_iterator:
+            if not isinstance(chunk, (bytes, memoryview)):
+                chunk = chunk.encode(self.charset)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
 
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
 
-_zhipu_client: Optional[ZhipuAiClient] = None
 
-def stream_zhipu_ai_response(question: str, pet_profile: Optional[PetProfile] = None) -> Generator[str, None, None]:
+# 回答缓存：键为 (问题, 宠物名称, 过敏原)，值为前端最终展示的完整回答
+_RESPONSE_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=3600)
+# 命中缓存时每个内容帧回放的字符数
+_REPLAY_CHUNK_SIZE = 20
+
+async def iter_chat_completion_chunks(client: "httpx.AsyncClient", api_key: str, payload: dict[str, Any]) -> AsyncGenerator[dict[str, Any], None]:
+    """调用智谱 AI 流式对话接口，逐个返回解析后的数据块。
+    
+    Args:
+        client: 复用的异步 HTTP 客户端
+        api_key: 智谱 AI API Key
+        payload: 请求体（model、messages 等参数）
+        
+    Yields:
+        dict: 每个 SSE 数据帧解析后的 chunk
+    """
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+    async with client.stream("POST", "chat/completions", content=orjson.dumps(payload), headers=headers) as response:
+        if response.status_code != 200:
+            detail = (await response.aread()).decode("utf-8", errors="replace")
+            raise RuntimeError(f"HTTP {response.status_code}: {detail}")
+
+        # SSE 格式：每个事件为 "data: {...}"，以 "data: [DONE]" 结束
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            if data:
+                yield orjson.loads(data)
+
+async def stream_zhipu_ai_response(question: str, pet_profile: Optional[PetProfile] = None) -> AsyncGenerator[bytes, None]:
     """流式调用智谱 AI 接口，实时返回文本块。
     
     Args:
@@ -296,43 +441,54 @@ def stream_zhipu_ai_response(question: str, pet_profile: Optional[PetProfile] =
         pet_profile: 可选的宠物档案信息，包含过敏原等
     
     Yields:
-        str: JSON格式的数据块，包含content字段。
+        bytes: SSE 格式的 JSON 数据帧，包含content字段（"思考中"状态由 SSEResponse 发送）。
     """
-    start_time = time.time()
+    # 只在开始和结束时计时，流式热路径上不做逐块计时
+    start_ns = time.perf_counter_ns()
     
     # 用于收集完整内容，以便在最后进行格式化
-    full_content_buffer = []
+    full_content_buffer = io.StringIO()
+    # 记录实际发送给前端的内容（含实时补齐的空行），用于判断结束后是否还需要发送格式化结果
+    emitted_buffer = io.StringIO()
     api_key: Optional[str] = os.getenv("ZHIPU_API_KEY")
     if not api_key:
         logger.error("❌ ZHIPU_API_KEY 环境变量未配置")
-        error_msg = json.dumps({"error": "服务器未配置 AI 服务，请联系管理员。"}, ensure_ascii=False)
-        yield f"data: {error_msg}\n\n"
+        yield _SSE_ERR_NO_KEY
         return
     
     # 记录 API Key 是否配置（不记录实际值）
     logger.info("✅ ZHIPU_API_KEY 已配置（长度: %d）", len(api_key) if api_key else 0)
 
-    # 优化：立即发送"思考中"状态，让前端立即知道请求已收到（优化首字节时间）
-    # 这样即使后续处理慢，用户也能立即看到响应
-    yield f"data: {json.dumps({'status': 'thinking'}, ensure_ascii=False)}\n\n"
-
-    global _zhipu_client
-    if _zhipu_client is None:
-        try:
-            _zhipu_client = ZhipuAiClient(api_key=api_key)
-        except Exception as exc:
-            logger.error("❌ 初始化智谱 AI 客户端失败：%s", exc)
-            error_msg = json.dumps({"error": "AI 客户端初始化失败，请检查配置。"}, ensure_ascii=False)
-            yield f"data: {error_msg}\n\n"
-            return
+    # 命中回答缓存：相同问题与过敏原直接从内存回放，无需调用上游模型
+    normalized_question = normalize_question(question)
+    has_allergies = bool(pet_profile and pet_profile.allergies)
+    cache_key = (
+        normalized_question,
+        pet_profile.name if has_allergies else None,
+        tuple(sorted(pet_profile.allergies)) if has_allergies else (),
+    )
+    cached_answer = _RESPONSE_CACHE.get(cache_key)
+    if cached_answer is not None:
+        # 按小段回放，保留逐字输出的体验，每段之间让出事件循环
+        for i in range(0, len(cached_answer), _REPLAY_CHUNK_SIZE):
+            yield _content_frame(cached_answer[i:i + _REPLAY_CHUNK_SIZE])
+            await asyncio.sleep(0)
+        logger.info("✅ 命中回答缓存，总耗时: %.3fs", (time.perf_counter_ns() - start_ns) / 1e9)
+        yield _SSE_DONE
+        return
 
-    client = _zhipu_client
+    # 复用启动时创建的异步 HTTP 客户端，等待上游数据时不占用线程池
+    # 未执行启动钩子或已关闭时为 None，返回初始化失败的提示
+    client = getattr(app.state, "http", None)
+    if client is None:
+        yield _SSE_ERR_INIT
+        return
 
     # 1. 判断问题类型：是否为"能不能吃"类问题
     is_safety = is_safety_question(question)
 
     # 2. RAG 检索：根据用户问题从知识库中获取相关信息（优化：快速检索，减少开销）
-    rag_context = get_rag_info(question)
+    rag_context = get_rag_info(normalized_question)
 
     # 3. 根据问题类型和宠物档案构建动态系统提示词（优化：简化提示词长度）
     system_prompt = build_system_prompt(question, pet_profile)
@@ -352,117 +508,127 @@ def stream_zhipu_ai_response(question: str, pet_profile: Optional[PetProfile] =
         
         # 启用流式传输
         # 优化参数以提升速度：降低temperature、减少max_tokens、优化模型参数
-        response_stream = client.chat.completions.create(
-            model=ZHIPU_MODEL_NAME,
-            messages=messages,
-            stream=True,
-            max_tokens=600,  # 设置为600，确保三个部分都能完整输出
-            temperature=0.1,  # 进一步降低到0.1，加快响应速度
-            top_p=0.8,  # 添加top_p参数，加快采样速度
-        )
-
-        first_chunk_time = None
+        response_stream = iter_chat_completion_chunks(client, api_key, {
+            "model": ZHIPU_MODEL_NAME,
+            "messages": messages,
+            "stream": True,
+            "max_tokens": 600,  # 设置为600，确保三个部分都能完整输出
+            "temperature": 0.1,  # 进一步降低到0.1，加快响应速度
+            "top_p": 0.8,  # 添加top_p参数，加快采样速度
+        })
+
+        first_chunk_logged = False
+        # 流式分段状态：当前章节、已发送内容末尾的换行数、尚未确定是否为章节标题的暂存片段
+        section = -1
+        trailing_newlines = 0
+        pending = ''
+        # 上游给出的结束原因（"stop" 正常结束，"length" 被 max_tokens 截断），通常在最后一个数据块中
+        finish_reason = None
         # 流式返回每个数据块 - 直接迭代，立即发送
-        for chunk in response_stream:
-            # 处理不同类型的chunk（dict或对象）
-            if isinstance(chunk, dict):
-                choices = chunk.get("choices", [])
-            elif hasattr(chunk, "choices"):
-                choices = getattr(chunk, "choices", [])
-            else:
-                # 尝试转换为dict
-                choices = []
-                if hasattr(chunk, "__dict__"):
-                    chunk_dict = chunk.__dict__
-                    choices = chunk_dict.get("choices", [])
+        async for chunk in response_stream:
+            # 上游数据块均由 orjson 解析为 dict，结构固定，直接按路径取值
+            choices = chunk.get("choices")
+            if not choices:
+                continue
+            # 最后一个数据块的 content 通常为空，需在跳过空内容之前记录
+            finish_reason = choices[0].get("finish_reason") or finish_reason
+
+            # 明确忽略思考过程（reasoning_content），只处理实际内容（content）
+            # 根据智谱AI文档，思考过程通过 reasoning_content 传递，实际内容通过 content 传递
+            # 一个chunk可能同时包含 reasoning_content 和 content，我们只处理 content
+            content = choices[0].get("delta", {}).get("content")
+
+            # 如果这个chunk只有 reasoning_content 而没有 content，跳过
+            if not content:
+                continue
+
+            # 思考过程已通过 reasoning_content 单独传递，content 通常是干净的；
+            # filter_thinking_content 对不含 '<' 的片段直接返回，完整清理统一在结束后的格式化中进行
+            filtered_content = filter_thinking_content(content)
+            # 如果过滤后内容为空，跳过这个chunk
+            if not filtered_content:
+                continue
             
-            if choices and len(choices) > 0:
-                choice = choices[0]
-                # 提取delta
-                if isinstance(choice, dict):
-                    delta = choice.get("delta", {})
-                elif hasattr(choice, "delta"):
-                    delta = getattr(choice, "delta", {})
-                else:
-                    delta = {}
-                
-                # 明确忽略思考过程（reasoning_content），只处理实际内容（content）
-                # 根据智谱AI文档，思考过程通过 reasoning_content 传递，实际内容通过 content 传递
-                # 一个chunk可能同时包含 reasoning_content 和 content，我们只处理 content
-                if isinstance(delta, dict):
-                    # 只提取 content，忽略 reasoning_content
-                    content = delta.get("content")
-                elif hasattr(delta, "content"):
-                    content = getattr(delta, "content", None)
-                else:
-                    content = None
-                
-                # 如果这个chunk只有 reasoning_content 而没有 content，跳过
-                if not content:
+            # 记录首字节时间（仅第一次）
+            if not first_chunk_logged:
+                first_chunk_logged = True
+                logger.info("⚡ 首字节时间: %.3fs", (time.perf_counter_ns() - start_ns) / 1e9)
+            
+            # 收集内容用于最终格式化（使用原始内容，在最后统一过滤）
+            full_content_buffer.write(content)
+
+            # "能不能吃"类问题：实时在章节标题前补齐空行，前端无需等待结束后的格式化即可分段显示
+            if is_safety:
+                filtered_content = pending + filtered_content
+                pending = ''
+                # 片段末尾可能是被截断的章节标题，暂存到下一个片段再判断
+                bracket = filtered_content.rfind('【')
+                if bracket != -1 and '】' not in filtered_content[bracket:] \
+                        and len(filtered_content) - bracket < _MAX_SECTION_MARKER_LEN:
+                    pending = filtered_content[bracket:]
+                    filtered_content = filtered_content[:bracket]
+                filtered_content, section, trailing_newlines = insert_section_breaks(
+                    filtered_content, section, trailing_newlines
+                )
+                if not filtered_content:
                     continue
-                
-                if content:
-                    # 实时过滤思考过程内容
-                    filtered_content = filter_thinking_content(content)
-                    
-                    # 如果过滤后内容为空，跳过这个chunk
-                    if not filtered_content:
-                        continue
-                    
-                    # 记录首字节时间（仅第一次）
-                    if first_chunk_time is None:
-                        first_chunk_time = time.time()
-                        elapsed = first_chunk_time - start_time
-                        logger.info(f"⚡ 首字节时间: {elapsed:.3f}s")
-                    
-                    # 收集内容用于最终格式化（使用原始内容，在最后统一过滤）
-                    full_content_buffer.append(content)
-                    # 立即发送过滤后的内容块，实现真正的逐字流式传输
-                    data = json.dumps({"content": filtered_content}, ensure_ascii=False)
-                    yield f"data: {data}\n\n"
+
+            # 立即发送过滤后的内容块，实现真正的逐字流式传输
+            emitted_buffer.write(filtered_content)
+            yield _content_frame(filtered_content)
+
+        # 发送最后暂存的片段（模型输出以不完整的标题结尾）
+        if pending:
+            emitted_buffer.write(pending)
+            yield _content_frame(pending)
 
         # 流式传输完成后，进行格式化处理（异步处理，不阻塞流式输出）
-        if full_content_buffer:
-            full_text = ''.join(full_content_buffer)
+        if full_content_buffer.tell():
+            full_text = full_content_buffer.getvalue()
+            # 被截断（"length"）或未收到结束原因（连接提前结束）的回答不写入缓存
+            cacheable = finish_reason not in (None, "length")
+            if not cacheable:
+                logger.warning("⚠️ AI回答未正常结束（finish_reason=%s），不写入回答缓存", finish_reason)
             
             # 只在调试模式下记录详细日志（减少日志开销）
-            if logger.level <= logging.DEBUG:
-                logger.debug(f"📝 原始AI回答（前200字符）: {repr(full_text[:200])}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📝 原始AI回答（前200字符）: %r", full_text[:200])
             
             # 只有"能不能吃"类问题才检查格式和进行格式化
             if is_safety:
-                # 检查是否包含三个必要部分
-                has_risk_level = '【风险等级】' in full_text
-                has_risk_point = '【风险点】' in full_text
-                has_feeding_advice = '【喂养建议】' in full_text
+                # 格式化的同时检查是否包含三个必要部分
+                formatted_text, (has_risk_level, has_risk_point, has_feeding_advice) = format_ai_response(
+                    full_text, is_safety_question=True
+                )
                 
                 if not has_feeding_advice:
                     logger.warning("⚠️ AI回答缺少【喂养建议】部分，可能是max_tokens不足或被截断")
                 
-                formatted_text = format_ai_response(full_text, is_safety_question=True)
-                
-                # 发送格式化后的文本（如果格式有变化）
-                if formatted_text != full_text:
-                    yield f"data: {json.dumps({'formatted': formatted_text}, ensure_ascii=False)}\n\n"
+                # 前端已显示的内容与格式化结果不同时（如冒号统一、标签清理），才发送格式化后的文本
+                if formatted_text != emitted_buffer.getvalue():
+                    yield _sse({"formatted": formatted_text})
+                # 只缓存三个部分齐全的回答，避免被截断的回答在缓存有效期内被反复回放
+                if cacheable and has_risk_level and has_risk_point and has_feeding_advice:
+                    _RESPONSE_CACHE[cache_key] = formatted_text
             else:
                 # 非"能不能吃"类问题，不进行格式化，直接使用原始回答
                 logger.info("ℹ️ 非安全问题，跳过格式化处理")
+                if cacheable:
+                    _RESPONSE_CACHE[cache_key] = filter_thinking_content(full_text)
 
         # 发送结束标记
-        total_time = time.time() - start_time
-        logger.info(f"✅ 流式响应完成，总耗时: {total_time:.3f}s")
-        yield f"data: {json.dumps({'done': True}, ensure_ascii=False)}\n\n"
+        logger.info("✅ 流式响应完成，总耗时: %.3fs", (time.perf_counter_ns() - start_ns) / 1e9)
+        yield _SSE_DONE
 
     except Exception as exc:
         error_detail = str(exc)
         logger.error("❌ 调用智谱 AI 失败：%s", exc)
         logger.error("❌ 错误详情：%s", error_detail)
         # 在开发/调试模式下返回详细错误信息
-        if logger.level <= logging.DEBUG:
-            error_msg = json.dumps({"error": f"AI 服务调用失败：{error_detail}"}, ensure_ascii=False)
+        if logger.isEnabledFor(logging.DEBUG):
+            yield _sse({"error": f"AI 服务调用失败：{error_detail}"})
         else:
-            error_msg = json.dumps({"error": "AI 服务暂时不可用，请稍后再试。"}, ensure_ascii=False)
-        yield f"data: {error_msg}\n\n"
+            yield _SSE_ERR_UPSTREAM
 
 
 @app.get("/")
@@ -492,8 +658,9 @@ async def ask_ai(request: AskRequest):
         raise HTTPException(status_code=400, detail="问题不能为空，请提供宠物食品或健康相关的问题。")
 
     # 返回流式响应，使用 Server-Sent Events (SSE)
-    # 传递宠物档案信息给流式响应函数
-    return StreamingResponse(
+    # 传递宠物档案信息给流式响应函数；SSEResponse 会先立即发送"思考中"状态，
+    # 让前端立即知道请求已收到，即使后续处理慢，用户也能立即看到响应
+    return SSEResponse(
         stream_zhipu_ai_response(question, request.pet_profile),
         media_type="text/event-stream",
         headers={
@@ -507,9 +674,19 @@ async def ask_ai(request: AskRequest):
 if __name__ == "__main__":
     # 当直接运行该文件时，启动 Uvicorn 服务器。
     # host=0.0.0.0 方便在局域网内访问，端口默认 3000，可通过环境变量 PORT 覆盖。
+    # 使用 uvloop 事件循环与 httptools 解析器（均由 uvicorn[standard] 安装）降低框架开销；
+    # uvloop 不支持 Windows，Windows 下回退为默认事件循环。
+    import sys
     import uvicorn
 
     port = int(os.getenv("PORT", "3000"))
     logger.info("✅ AI 问答接口已启动：http://localhost:%s", port)
-    uvicorn.run("app:app", host="0.0.0.0", port=port, reload=False)
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=port,
+        reload=False,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+    )
 
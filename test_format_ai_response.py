@@ -0,0 +1,74 @@
+"""test_format_ai_response.py
+------------------------------
+format_ai_response 的期望输出对照表。
+
+运行方式（需先安装 requirements.txt 中的依赖）：
+    python test_format_ai_response.py
+或
+    python -m pytest test_format_ai_response.py
+"""
+
+from app import format_ai_response
+
+
+# (原始AI回答, 期望的格式化结果)
+CASES = [
+    # 标准三段式：保持不变
+    ("【风险等级】：高危\n\n【风险点】：含可可碱\n\n【喂养建议】：禁止",
+     "【风险等级】：高危\n\n【风险点】：含可可碱\n\n【喂养建议】：禁止"),
+    # 英文冒号统一为中文冒号，标题之间插入空行
+    ("【风险等级】:高危【风险点】:含可可碱【喂养建议】:禁止",
+     "【风险等级】：高危\n\n【风险点】：含可可碱\n\n【喂养建议】：禁止"),
+    # 移除思考过程标签与多余空行
+    ("<thinking>abc</thinking>【风险等级】：中\n\n\n【风险点】：x\ny\n【喂养建议】 : 煮熟",
+     "【风险等级】：中\n\n【风险点】：x\ny\n\n【喂养建议】：煮熟"),
+    # 移除残留的思考过程文本
+    ("思考过程：嗯【风险等级】：低\n【风险点】：a\n【喂养建议】：b",
+     "【风险等级】：低\n\n【风险点】：a\n\n【喂养建议】：b"),
+    # 章节内的空行与行首尾空白被去掉
+    ("【风险点】：a\n\n\n  b  \n【喂养建议】：c",
+     "【风险点】：a\nb\n\n【喂养建议】：c"),
+    # 非章节标题的【】不视为分段
+    ("【风险等级】：高\n【风险点】：【高危预警】含可可碱\n【喂养建议】：禁止",
+     "【风险等级】：高\n\n【风险点】：【高危预警】含可可碱\n\n【喂养建议】：禁止"),
+    # 第一个标题前的内容保留，只换行不加空行
+    ("前言\n【风险等级】：高", "前言\n【风险等级】：高"),
+    # 没有章节标题的回答保持原样
+    ("没有格式的回答", "没有格式的回答"),
+    ("", ""),
+
+    # 以下为单次扫描实现相对旧版逐行实现的行为变化
+    # 标题后直接换行：内容上移到标题所在行（旧版：“【风险等级】：\n有毒”）
+    ("【风险等级】\n有毒", "【风险等级】：有毒"),
+    # 标题前同一行有内容：标题另起一行（旧版：“前言【风险等级】：高”）
+    ("前言【风险等级】：高", "前言\n【风险等级】：高"),
+    ("【风险等级】：高\n说明【风险点】：x", "【风险等级】：高\n说明\n\n【风险点】：x"),
+    # 任意两个标题在同一行：都按章节分段（旧版只处理 风险等级→风险点、风险点→喂养建议）
+    ("【风险等级】：高【喂养建议】：x", "【风险等级】：高\n\n【喂养建议】：x"),
+    ("【喂养建议】：a【风险等级】：b", "【喂养建议】：a\n\n【风险等级】：b"),
+    # 冒号前有空白且后面还有标题时不再出现重复冒号（旧版：“【风险点】：： 高”）
+    ("【风险点】 ： 高\n【喂养建议】:x", "【风险点】：高\n\n【喂养建议】：x"),
+]
+
+
+def test_format_ai_response():
+    for text, expected in CASES:
+        formatted, _ = format_ai_response(text)
+        assert formatted == expected, f"{text!r}: {formatted!r} != {expected!r}"
+
+
+def test_format_ai_response_section_flags():
+    _, flags = format_ai_response("【风险等级】：高\n【喂养建议】：禁止")
+    assert flags == (True, False, True)
+
+
+def test_non_safety_question_is_unchanged():
+    text = "【风险等级】\n有毒"
+    assert format_ai_response(text, is_safety_question=False) == (text, (False, False, False))
+
+
+if __name__ == "__main__":
+    test_format_ai_response()
+    test_format_ai_response_section_flags()
+    test_non_safety_question_is_unchanged()
+    print(f"✅ {len(CASES)} 个格式化用例全部通过")
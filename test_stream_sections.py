@@ -0,0 +1,162 @@
+"""test_stream_sections.py
+------------------------
+流式分段（insert_section_breaks + 标题截断暂存 + 结束后的格式化帧）的对照表。
+
+把同一个回答按不同大小切成流式片段，经 stream_zhipu_ai_response 完整走一遍，
+检查前端最终展示的内容与 format_ai_response 的结果一致。
+
+运行方式（需先安装 requirements.txt 中的依赖）：
+    python test_stream_sections.py
+或
+    python -m pytest test_stream_sections.py
+"""
+
+import asyncio
+import os
+
+import httpx
+import orjson
+
+import app
+from app import format_ai_response, insert_section_breaks
+
+
+# (片段, 当前章节, 末尾换行数, 期望结果)
+BREAK_CASES = [
+    # 回答以第一个标题开头：不补空行
+    ("【风险等级】：a", -1, 0, ("【风险等级】：a", 0, 0)),
+    # 回答以后面的章节开头：同样不补空行
+    ("【风险点】：a\n【喂养建议】：b", -1, 0, ("【风险点】：a\n\n【喂养建议】：b", 2, 0)),
+    ("【喂养建议】：a", -1, 0, ("【喂养建议】：a", 2, 0)),
+    # 同一片段内出现多个标题
+    ("【风险等级】：a【风险点】：b", -1, 0, ("【风险等级】：a\n\n【风险点】：b", 1, 0)),
+    # 之前的片段已进入章节：按已发送的换行数补齐
+    ("【风险点】：b", 0, 0, ("\n\n【风险点】：b", 1, 0)),
+    ("【风险点】：b", 0, 1, ("\n【风险点】：b", 1, 0)),
+    ("【风险点】：b", 0, 2, ("【风险点】：b", 1, 0)),
+    ("\n【喂养建议】：c", 1, 0, ("\n\n【喂养建议】：c", 2, 0)),
+    # 非章节标题的【】与已经过去的章节都不分段
+    ("【高危预警】x", 1, 0, ("【高危预警】x", 1, 0)),
+    ("【风险等级】x", 1, 0, ("【风险等级】x", 1, 0)),
+    # 末尾换行数跨片段累加
+    ("\n", 0, 1, ("\n", 0, 2)),
+]
+
+# 能被实时分段完整还原的回答：流式内容应与格式化结果完全相同，不需要额外的格式化帧
+CLEAN_ANSWERS = [
+    "【风险等级】：高危\n\n【风险点】：含可可碱\n\n【喂养建议】：禁止",
+    "【风险等级】：高危\n【风险点】：含可可碱\n【喂养建议】：禁止",
+    "【风险等级】：高【风险点】：x【喂养建议】：y",
+    "【风险点】：a\n【喂养建议】：b",
+    "【风险等级】：高\n【风险点】：【高危预警】含可可碱\n【喂养建议】：禁止",
+    "前言\n【风险等级】：高",
+]
+
+# 实时分段无法还原的回答（冒号统一、标签清理等）：结束后应发送格式化帧
+FORMATTED_ANSWERS = [
+    "【风险等级】:高危【风险点】:含可可碱【喂养建议】:禁止",
+    "<thinking>abc</thinking>【风险等级】：中\n\n\n【风险点】：x\ny\n【喂养建议】 : 煮熟",
+    "【风险等级】\n有毒",
+    "【风险等级】：高\n【风险点】：未完待续【喂养",
+]
+
+CHUNK_SIZES = [1, 2, 3, 5, 1000]
+
+QUESTION = "巧克力能不能吃"
+
+
+def _split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def _upstream(pieces, finish_reason="stop"):
+    """模拟智谱 AI 的 SSE 响应：每个片段一个数据帧，最后一帧带 finish_reason（None 表示没有结束帧）。"""
+    lines = [
+        b"data: " + orjson.dumps({"choices": [{"index": 0, "delta": {"content": piece}}]})
+        for piece in pieces
+    ]
+    if finish_reason is not None:
+        lines.append(b"data: " + orjson.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}))
+    lines.append(b"data: [DONE]")
+    body = b"\n\n".join(lines) + b"\n\n"
+    return httpx.MockTransport(lambda request: httpx.Response(200, content=body))
+
+
+def _stream(pieces, question=QUESTION, finish_reason="stop"):
+    """按给定片段走一遍 stream_zhipu_ai_response，返回 (流式拼接的内容, 格式化帧或 None)。"""
+    async def run():
+        app._RESPONSE_CACHE.clear()
+        app.app.state.http = httpx.AsyncClient(base_url=app.ZHIPU_BASE_URL, transport=_upstream(pieces, finish_reason))
+        try:
+            frames = [frame async for frame in app.stream_zhipu_ai_response(question)]
+        finally:
+            await app.app.state.http.aclose()
+            app.app.state.http = None
+        return frames
+
+    os.environ.setdefault("ZHIPU_API_KEY", "test-key")
+    streamed = []
+    formatted = None
+    for frame in asyncio.run(run()):
+        payload = orjson.loads(frame[len(b"data: "):])
+        assert "error" not in payload, payload
+        if "content" in payload:
+            streamed.append(payload["content"])
+        if "formatted" in payload:
+            formatted = payload["formatted"]
+    return ''.join(streamed), formatted
+
+
+def test_insert_section_breaks():
+    for text, section, trailing_newlines, expected in BREAK_CASES:
+        result = insert_section_breaks(text, section, trailing_newlines)
+        assert result == expected, f"{(text, section, trailing_newlines)!r}: {result!r} != {expected!r}"
+
+
+def test_clean_answers_stream_without_formatted_frame():
+    for answer in CLEAN_ANSWERS:
+        expected, _ = format_ai_response(answer)
+        for size in CHUNK_SIZES:
+            streamed, formatted = _stream(_split(answer, size))
+            assert streamed == expected, f"{answer!r} / {size}: {streamed!r} != {expected!r}"
+            assert formatted is None, f"{answer!r} / {size}: 多余的格式化帧 {formatted!r}"
+
+
+def test_formatted_frame_sent_when_stream_differs():
+    for answer in FORMATTED_ANSWERS:
+        expected, _ = format_ai_response(answer)
+        for size in CHUNK_SIZES:
+            streamed, formatted = _stream(_split(answer, size))
+            if streamed != expected:
+                assert formatted == expected, f"{answer!r} / {size}: {formatted!r} != {expected!r}"
+            else:
+                assert formatted is None, f"{answer!r} / {size}: 多余的格式化帧 {formatted!r}"
+
+
+def test_header_split_across_chunks():
+    # 标题在任意位置被截断到下一个片段，都要在完整标题前补齐空行
+    answer = "【风险等级】：高\n【风险点】：x"
+    expected, _ = format_ai_response(answer)
+    header = answer.index("【风险点】")
+    for cut in range(header, header + len("【风险点】") + 1):
+        streamed, formatted = _stream([answer[:cut], answer[cut:]])
+        assert streamed == expected, f"cut={cut}: {streamed!r} != {expected!r}"
+        assert formatted is None
+
+
+def test_only_finished_answers_are_cached():
+    # 被 max_tokens 截断或没有收到结束原因的回答不写入缓存；安全问题与普通问题都适用
+    answer = CLEAN_ANSWERS[0]
+    for question in (QUESTION, "狗狗每天喂几次"):
+        for finish_reason, cached in (("stop", True), ("length", False), (None, False)):
+            _stream(_split(answer, 5), question, finish_reason)
+            assert bool(app._RESPONSE_CACHE) == cached, f"{question!r} / {finish_reason!r}"
+
+
+if __name__ == "__main__":
+    test_insert_section_breaks()
+    test_clean_answers_stream_without_formatted_frame()
+    test_formatted_frame_sent_when_stream_differs()
+    test_header_split_across_chunks()
+    test_only_finished_answers_are_cached()
+    print(f"✅ {len(BREAK_CASES)} 个分段用例、{len(CLEAN_ANSWERS) + len(FORMATTED_ANSWERS)} 个流式回答全部通过")